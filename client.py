@@ -1,10 +1,20 @@
 # client.py
+import argparse
 import socket
-from protocol import unpack_offer, pack_request, OFFER_UDP_PORT, get_preferred_ip
+from protocol import try_unpack_offer, pack_request, OFFER_UDP_PORT, get_preferred_ip, apply_socket_options
 
 TEAM_NAME = "NoSocketsJustCards_v2"
 
-def main():
+# Options applied to the TCP session socket right after connect.
+# Messages are tiny, so disable Nagle to send each one immediately
+# and keep the kernel buffers small.
+TCP_SOCKET_OPTIONS = (
+    (socket.IPPROTO_TCP, socket.TCP_NODELAY, 1),
+    (socket.SOL_SOCKET, socket.SO_SNDBUF, 4096),
+    (socket.SOL_SOCKET, socket.SO_RCVBUF, 4096),
+)
+
+def main(strict_name: bool = True, preferred_ip_only: bool = True, socket_options=TCP_SOCKET_OPTIONS):
     print("Client started, listening for offer requests...")
 
     PREFERRED_IP = get_preferred_ip()
@@ -23,32 +33,36 @@ def main():
 
     udp.bind(("", OFFER_UDP_PORT))
 
+    # one receive buffer for the whole session, offers are parsed in place
+    rx_buf = bytearray(4096)
+    rx_mv = memoryview(rx_buf)
+    recvfrom_into = udp.recvfrom_into
+
     while True:
         try:
-            data, addr = udp.recvfrom(4096)
+            nbytes, addr = recvfrom_into(rx_buf)
+            data = rx_mv[:nbytes]
             sender_ip = addr[0]
-            try:
-                tcp_port, server_name = unpack_offer(data)
-                if server_name != TEAM_NAME:
-                    continue
-
-                print("DEBUG offer from:", sender_ip)
-                if sender_ip != PREFERRED_IP:
-                    continue
+            offer = try_unpack_offer(data)
+            if offer is None:
+                continue
+            tcp_port, server_name = offer
+            if strict_name and server_name != TEAM_NAME:
+                continue
 
-            except ValueError:
+            if preferred_ip_only and sender_ip != PREFERRED_IP:
                 continue
 
             print(f"Received offer from {sender_ip} (server_name={server_name}, tcp_port={tcp_port})")
 
             # --- ask user rounds ---
             rounds_str = input("How many rounds do you want to play? (1-255): ").strip()
-            try:
+            # at most 3 digits, so int() never sees an oversized string
+            if 1 <= len(rounds_str) <= 3 and rounds_str.isdecimal():
                 num_rounds = int(rounds_str)
-                if not (1 <= num_rounds <= 255):
-                    raise ValueError
-            except ValueError:
-
+            else:
+                num_rounds = 0
+            if not (1 <= num_rounds <= 255):
                 print("Invalid number of rounds. Going back to listening...")
                 continue
 
@@ -60,6 +74,7 @@ def main():
             try:
 
                 tcp.connect((sender_ip, tcp_port))
+                apply_socket_options(tcp, socket_options)
                 req = pack_request(num_rounds, TEAM_NAME)
                 tcp.sendall(req)
 
@@ -84,4 +99,10 @@ def main():
 
 
 if __name__ == "__main__":
-    main()
+    parser = argparse.ArgumentParser(description="Blackjack client")
+    parser.add_argument("--any-server", action="store_true",
+                        help="accept offers from servers with any name, not just our team's")
+    parser.add_argument("--any-ip", action="store_true",
+                        help="accept offers from any sender IP, not just our preferred IP")
+    args = parser.parse_args()
+    main(strict_name=not args.any_server, preferred_ip_only=not args.any_ip)
@@ -1,55 +1,148 @@
 # protocol.py
+import functools
 import struct
 import socket
-def get_preferred_ip() -> str:
+import sys
+
+__all__ = [
+    "MAGIC_COOKIE", "MSG_TYPE_OFFER", "MSG_TYPE_REQUEST", "OFFER_UDP_PORT",
+    "HEADER_STRUCT", "OFFER_STRUCT", "REQUEST_STRUCT",
+    "get_preferred_ip", "apply_socket_options", "recv_exact",
+    "encode_fixed_name", "decode_fixed_name",
+    "pack_offer", "build_offer_cached", "unpack_offer", "try_unpack_offer",
+    "pack_request", "unpack_request",
+]
+
+
+# Cached only after a successful lookup, so a temporary no-route failure
+# is retried on the next call
+_LOCAL_IP = None
+
+
+def get_preferred_ip(fallback: str = "127.0.0.1") -> str:
+    global _LOCAL_IP
+    if _LOCAL_IP is not None:
+        return _LOCAL_IP
     s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
     try:
         s.connect(("8.8.8.8", 80))
-        return s.getsockname()[0]
+        _LOCAL_IP = s.getsockname()[0]
+        return _LOCAL_IP
+    except OSError:
+        # no route (offline), still let the caller start
+        return fallback
     finally:
         s.close()
 
+
+def apply_socket_options(sock: socket.socket, options) -> None:
+    """Apply (level, option, value) triples, skipping ones the platform rejects."""
+    for level, opt, value in options:
+        try:
+            sock.setsockopt(level, opt, value)
+        except OSError:
+            pass
+
+
+def recv_exact(sock: socket.socket, n: int) -> bytes:
+    """Read exactly n bytes from a stream socket or raise ConnectionError."""
+    buf = bytearray(n)
+    mv = memoryview(buf)
+    got = 0
+    while got < n:
+        k = sock.recv_into(mv[got:], n - got)
+        if not k:
+            raise ConnectionError("Socket closed while reading")
+        got += k
+    return bytes(buf)
+
 MAGIC_COOKIE = 0xabcddcba
 MSG_TYPE_OFFER = 0x2
 
+# Every message starts with magic cookie (4) | msg type (1)
+HEADER_STRUCT = struct.Struct("!IB")
+_OFFER_HDR = HEADER_STRUCT.pack(MAGIC_COOKIE, MSG_TYPE_OFFER)
+_HDR_SIZE = HEADER_STRUCT.size
+
 OFFER_UDP_PORT = 13122
 
 # Offer format:
 # magic cookie (4 bytes, big-endian) | msg type (1 byte) | server tcp port (2 bytes, big-endian) | server name (32 bytes)
 OFFER_STRUCT = struct.Struct("!IBH32s")  # I=4, B=1, H=2, 32s=32
+_OFFER_BODY_STRUCT = struct.Struct("!H32s")  # everything after the header
+
+# bound once so the pack/unpack paths skip the attribute lookups
+_OFFER_SIZE = OFFER_STRUCT.size
+_offer_pack = OFFER_STRUCT.pack
+_offer_body_unpack = _OFFER_BODY_STRUCT.unpack_from
 
 
+@functools.lru_cache(maxsize=64)
 def encode_fixed_name(name: str, size: int = 32) -> bytes:
     b = name.encode("utf-8", errors="ignore")
-    if len(b) >= size:
-        return b[:size]
-    return b + b"\x00" * (size - len(b))
+    return b[:size].ljust(size, b"\x00")
+
+
+# Decoded names by raw bytes; clients and servers keep sending the same few
+# names, so reuse the interned str. Bounded so junk packets can't grow it.
+_NAME_CACHE_MAX = 1024
+_name_cache: dict = {}
 
 
 def decode_fixed_name(raw: bytes) -> str:
     # strip trailing nulls
-    return raw.split(b"\x00", 1)[0].decode("utf-8", errors="ignore")
+    key = raw.split(b"\x00", 1)[0]
+    if type(key) is not bytes:
+        # bytearray and friends aren't hashable
+        key = bytes(key)
+    name = _name_cache.get(key)
+    if name is None:
+        name = sys.intern(key.decode("utf-8", errors="ignore"))
+        if len(_name_cache) < _NAME_CACHE_MAX:
+            _name_cache[key] = name
+    return name
+
+
+def _header_error(data: bytes, what: str) -> ValueError:
+    # slow path, only reached when the 5-byte header compare failed
+    cookie, _ = HEADER_STRUCT.unpack_from(data, 0)
+    if cookie != MAGIC_COOKIE:
+        return ValueError("Bad magic cookie")
+    return ValueError(f"Not {what} packet")
 
 
 def pack_offer(server_tcp_port: int, server_name: str) -> bytes:
     if not (0 <= server_tcp_port <= 65535):
         raise ValueError("server_tcp_port must be in 0..65535")
     name_bytes = encode_fixed_name(server_name, 32)
-    return OFFER_STRUCT.pack(MAGIC_COOKIE, MSG_TYPE_OFFER, server_tcp_port, name_bytes)
+    return _offer_pack(MAGIC_COOKIE, MSG_TYPE_OFFER, server_tcp_port, name_bytes)
+
+
+@functools.lru_cache(maxsize=4)
+def build_offer_cached(server_tcp_port: int, server_name: str) -> bytes:
+    """pack_offer for offers that never change during the process lifetime."""
+    return pack_offer(server_tcp_port, server_name)
 
 
 def unpack_offer(data: bytes):
     """Returns (server_tcp_port, server_name) or raises ValueError."""
-    if len(data) != OFFER_STRUCT.size:
-        raise ValueError(f"Bad offer length: {len(data)} != {OFFER_STRUCT.size}")
-    cookie, mtype, port, name_raw = OFFER_STRUCT.unpack(data)
-    if cookie != MAGIC_COOKIE:
-        raise ValueError("Bad magic cookie")
-    if mtype != MSG_TYPE_OFFER:
-        raise ValueError("Not an offer packet")
+    if len(data) != _OFFER_SIZE:
+        raise ValueError(f"Bad offer length: {len(data)} != {_OFFER_SIZE}")
+    if data[:_HDR_SIZE] != _OFFER_HDR:
+        raise _header_error(data, "an offer")
+    port, name_raw = _offer_body_unpack(data, _HDR_SIZE)
+    return port, decode_fixed_name(name_raw)
+
+
+def try_unpack_offer(data: bytes):
+    """Like unpack_offer, but returns None instead of raising for non-offer packets."""
+    if len(data) != _OFFER_SIZE or data[:_HDR_SIZE] != _OFFER_HDR:
+        return None
+    port, name_raw = _offer_body_unpack(data, _HDR_SIZE)
     return port, decode_fixed_name(name_raw)
 
 MSG_TYPE_REQUEST = 0x3
+_REQUEST_HDR = HEADER_STRUCT.pack(MAGIC_COOKIE, MSG_TYPE_REQUEST)
 
 
 
@@ -58,24 +151,27 @@ MSG_TYPE_REQUEST = 0x3
 # Request format:
 # magic (4) | type (1) | num_rounds (1) | client name (32)
 REQUEST_STRUCT = struct.Struct("!IBB32s")  # I=4, B=1, B=1, 32s=32
+_REQUEST_BODY_STRUCT = struct.Struct("!B32s")  # everything after the header
+
+_REQUEST_SIZE = REQUEST_STRUCT.size
+_request_pack = REQUEST_STRUCT.pack
+_request_body_unpack = _REQUEST_BODY_STRUCT.unpack_from
 
 
 def pack_request(num_rounds: int, client_name: str) -> bytes:
     if not (1 <= num_rounds <= 255):
         raise ValueError("num_rounds must be in 1..255")
     name_bytes = encode_fixed_name(client_name, 32)
-    return REQUEST_STRUCT.pack(MAGIC_COOKIE, MSG_TYPE_REQUEST, num_rounds, name_bytes)
+    return _request_pack(MAGIC_COOKIE, MSG_TYPE_REQUEST, num_rounds, name_bytes)
 
 
 def unpack_request(data: bytes):
     """Returns (num_rounds, client_name) or raises ValueError."""
-    if len(data) != REQUEST_STRUCT.size:
-        raise ValueError(f"Bad request length: {len(data)} != {REQUEST_STRUCT.size}")
-    cookie, mtype, num_rounds, name_raw = REQUEST_STRUCT.unpack(data)
-    if cookie != MAGIC_COOKIE:
-        raise ValueError("Bad magic cookie")
-    if mtype != MSG_TYPE_REQUEST:
-        raise ValueError("Not a request packet")
+    if len(data) != _REQUEST_SIZE:
+        raise ValueError(f"Bad request length: {len(data)} != {_REQUEST_SIZE}")
+    if data[:_HDR_SIZE] != _REQUEST_HDR:
+        raise _header_error(data, "a request")
+    num_rounds, name_raw = _request_body_unpack(data, _HDR_SIZE)
     if num_rounds == 0:
         raise ValueError("num_rounds cannot be 0")
     return num_rounds, decode_fixed_name(name_raw)
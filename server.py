@@ -1,33 +1,35 @@
 # server.py
+import functools
+import selectors
 import socket
 import threading
 import time
-from protocol import pack_offer, unpack_request, OFFER_UDP_PORT
+from concurrent.futures import ThreadPoolExecutor
+from protocol import build_offer_cached, unpack_request, recv_exact, apply_socket_options, get_preferred_ip, OFFER_UDP_PORT, REQUEST_STRUCT
 
 TEAM_NAME = "NoSocketsJustCards_v2"
 
+# Options applied to every accepted client connection (small messages, no Nagle)
+CONN_SOCKET_OPTIONS = (
+    (socket.IPPROTO_TCP, socket.TCP_NODELAY, 1),
+)
 
+# Clients are served by a fixed pool; the timeout keeps a silent client from
+# holding a worker forever
+MAX_CLIENT_WORKERS = 16
+CLIENT_TIMEOUT = 5.0
+# Connections allowed to wait for a free worker; beyond that new clients are
+# closed right away instead of sitting in the pool queue with no reply
+MAX_PENDING_CLIENTS = 16
+
+# Offers go out every second; only report them this often
+OFFER_LOG_INTERVAL = 10.0
 
-def get_local_ip() -> str:
-    s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-    try:
-        s.connect(("8.8.8.8", 80))
-        return s.getsockname()[0]
-    except OSError:
-        return "0.0.0.0"
-    finally:
-        s.close()
 
 def handle_client(conn: socket.socket, addr):
     try:
-        expected = 4 + 1 + 1 + 32  # 38
-        data = b""
-        while len(data) < expected:
-            chunk = conn.recv(expected - len(data))
-            if not chunk:
-                raise ConnectionError("Client closed before sending full request")
-            data += chunk
-
+        apply_socket_options(conn, CONN_SOCKET_OPTIONS)
+        data = recv_exact(conn, REQUEST_STRUCT.size)  # 38
         num_rounds, client_name = unpack_request(data)
         print(f"[TCP] Client connected from {addr[0]}:{addr[1]} | name={client_name} | rounds={num_rounds}")
 
@@ -41,10 +43,20 @@ def handle_client(conn: socket.socket, addr):
             pass
 
 
+def _client_done(conn: socket.socket, slots: threading.Semaphore, future):
+    # jobs cancelled at shutdown never ran handle_client, so close their socket here
+    if future.cancelled():
+        try:
+            conn.close()
+        except OSError:
+            pass
+    slots.release()
+
+
 def main():
     print("### RUNNING SERVER.PY STAGE 2 ###")
 
-    ip = get_local_ip()
+    ip = get_preferred_ip("0.0.0.0")
     WIFI_IP = ip
 
     print(f"Server started, listening on IP address {ip}")
@@ -63,27 +75,48 @@ def main():
     udp.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
 
     udp.bind((WIFI_IP, 0))
-    offer = pack_offer(server_tcp_port, TEAM_NAME)
+    offer = build_offer_cached(server_tcp_port, TEAM_NAME)
     dest = ("255.255.255.255", OFFER_UDP_PORT)
+    sendto = udp.sendto
+
+    # sleep in the kernel until a client connects or the next offer is due
+    tcp.setblocking(False)
+    sel = selectors.DefaultSelector()
+    sel.register(tcp, selectors.EVENT_READ)
+
+    pool = ThreadPoolExecutor(max_workers=MAX_CLIENT_WORKERS)
+    slots = threading.Semaphore(MAX_CLIENT_WORKERS + MAX_PENDING_CLIENTS)
 
-    last_offer_time = 0.0
+    next_offer_time = time.monotonic()
+    next_offer_log_time = next_offer_time
+    offers_sent = 0
     while True:
         try:
             # 1) לשדר offer פעם בשנייה
-            now = time.time()
-            if now - last_offer_time >= 1.0:
-                udp.sendto(offer, dest)
-                print(f"[UDP] Sent offer (tcp_port={server_tcp_port}, name={TEAM_NAME})")
-                last_offer_time = now
-
-            # 2) לקבל TCP בלי להיתקע: נשים timeout קצר
-            tcp.settimeout(0.2)
+            now = time.monotonic()
+            if now >= next_offer_time:
+                next_offer_time = now + 1.0
+                sendto(offer, dest)
+                offers_sent += 1
+                if now >= next_offer_log_time:
+                    print(f"[UDP] Sent offer (tcp_port={server_tcp_port}, name={TEAM_NAME}, total={offers_sent})")
+                    next_offer_log_time = now + OFFER_LOG_INTERVAL
+
+            # 2) לקבל TCP בלי להיתקע: מחכים עד ה-offer הבא לכל היותר
+            if not sel.select(max(0.0, next_offer_time - time.monotonic())):
+                continue
             try:
                 conn, addr = tcp.accept()
-                t = threading.Thread(target=handle_client, args=(conn, addr), daemon=True)
-                t.start()
-            except socket.timeout:
-                pass
+            except BlockingIOError:
+                # client went away between select and accept
+                continue
+            if not slots.acquire(blocking=False):
+                print(f"[TCP] Too many clients, dropping {addr[0]}:{addr[1]}")
+                conn.close()
+                continue
+            conn.settimeout(CLIENT_TIMEOUT)
+            future = pool.submit(handle_client, conn, addr)
+            future.add_done_callback(functools.partial(_client_done, conn, slots))
 
         except KeyboardInterrupt:
             print("\nServer stopped.")
@@ -91,6 +124,8 @@ def main():
         except OSError as e:
             print(f"Server error: {e}")
 
+    pool.shutdown(wait=False, cancel_futures=True)
+    sel.close()
     udp.close()
     tcp.close()
 